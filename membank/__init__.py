@@ -1,5 +1,13 @@
 """
 Defines interfaces exposed to library user
 """
-from membank.interface import LoadMemory
 from membank.errors import *
+
+
+def __getattr__(name):
+    """Load the interface module and its SQL stack on first use."""
+    if name == "LoadMemory":
+        # pylint: disable=import-outside-toplevel
+        from membank.interface import LoadMemory
+        return LoadMemory
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,35 +1,44 @@
 """Module supports dataclass storage and retrieval."""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import pickle
+import pickletools
 
 from membank import errors as e
-from membank.datamethods import create_table, get_item, update_item
+from membank.datamethods import create_table, get_active_bind, get_item, update_item
 
 
-@dataclass
+@dataclass(slots=True)
 class TableClass:
     """Maps a dataclass to a Table."""
 
-    table: str = ""
+    table: str = field(default="", metadata={"key": True})
     classload: bytes = b""
 
 
 class Mapper:
     """Interface to store and retrieve dataclasses."""
 
+    __slots__ = ("engine", "metadata", "_cache", "sql_table")
+
     def __init__(self, engine, metadata):
         """Initialise."""
         self.engine = engine
         self.metadata = metadata
-        if "__meta_dataclasses__" not in metadata:
-            self._create_meta()
-        self.sql_table = self.metadata.tables["__meta_dataclasses__"]
+        self._cache = {}
+        self.sql_table = metadata.tables.get("__meta_dataclasses__")
 
     def _create_meta(self):
         """Create __meta_dataclasses__ table."""
         create_table("__meta_dataclasses__", TableClass(), self.engine)
-        self.metadata.reflect(bind=self.engine)
+        bind = get_active_bind(self.engine)
+        self.metadata.reflect(bind=bind, only=["__meta_dataclasses__"])
+        self.sql_table = self.metadata.tables["__meta_dataclasses__"]
+
+    def _assert_meta(self):
+        """Create __meta_dataclasses__ table if not yet present."""
+        if self.sql_table is None:
+            self._create_meta()
 
     def _handle_missing_meta(self, func, *args, **kwargs):
         """Run function such that missing __meta_dataclasses are taken into account.
@@ -45,19 +54,29 @@ class Mapper:
 
     def get_class(self, table):
         """Return dataclass representing table."""
-        try:
-            table_class = self._handle_missing_meta(
-                get_item, self.sql_table, self.engine, TableClass, **{"table": table}
-            )
-        except e.MemoryTableDoesNotExist:
-            table_class = None
-        if table_class:
-            return pickle.loads(table_class.classload)
-        return None
+        classload = self._cache.get(table)
+        if classload is None:
+            self._assert_meta()
+            try:
+                table_class = self._handle_missing_meta(
+                    get_item, self.sql_table, self.engine, TableClass, **{"table": table}
+                )
+            except e.MemoryTableDoesNotExist:
+                table_class = None
+            if not table_class:
+                return None
+            classload = table_class.classload
+            self._cache[table] = classload
+        return pickle.loads(classload)
 
     def put_class(self, table, table_class):
         """Store dataclass representing table."""
-        classload = pickle.dumps(table_class)
+        classload = pickletools.optimize(
+            pickle.dumps(table_class, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        if classload == self._cache.get(table):
+            return
+        self._assert_meta()
         args = (
             self.sql_table,
             self.engine,
@@ -68,3 +87,4 @@ class Mapper:
             self._handle_missing_meta(update_item, *args, **kargs)
         except e.MemoryTableDoesNotExist:
             update_item(*args, **kargs)
+        self._cache[table] = classload
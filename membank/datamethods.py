@@ -1,12 +1,78 @@
 """Functions to interact with database."""
-import dataclasses
+import contextlib
+import contextvars
 import datetime
+import sqlite3
 
 from alembic.migration import MigrationContext
 from alembic.operations import Operations
 import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
 
 from membank import errors as e
+from membank.utils import get_fields
+
+
+# Connection set for the duration of a LoadMemory.transaction block
+_ACTIVE_CONN = contextvars.ContextVar("membank_active_conn", default=None)
+
+
+def activate_connection(conn):
+    """Set conn as the active connection for the current context."""
+    return _ACTIVE_CONN.set(conn)
+
+
+def deactivate_connection(token):
+    """Restore the previous active connection state."""
+    _ACTIVE_CONN.reset(token)
+
+
+def _active_conn_of(engine):
+    """Return the active connection only when it belongs to engine.
+
+    Operations on another memory instance inside a transaction block
+    must not be routed into the block's connection and database.
+    """
+    conn = _ACTIVE_CONN.get()
+    return conn if conn is not None and conn.engine is engine else None
+
+
+def get_active_bind(engine):
+    """Return active transaction connection or engine itself."""
+    conn = _active_conn_of(engine)
+    return conn if conn is not None else engine
+
+
+@contextlib.contextmanager
+def connection(engine):
+    """Yield the active transaction connection or a fresh one."""
+    conn = _active_conn_of(engine)
+    if conn is not None:
+        yield conn
+    else:
+        with engine.connect() as conn:
+            yield conn
+
+
+@contextlib.contextmanager
+def writer(engine):
+    """Yield a connection whose writes are committed.
+
+    Inside a transaction block the active connection is handed out and
+    the commit is left to the block, otherwise a fresh connection with
+    its own transaction is provided.
+    """
+    conn = _active_conn_of(engine)
+    if conn is not None:
+        yield conn
+    else:
+        with engine.connect() as conn:
+            with conn.begin():
+                yield conn
+
+
+# RETURNING needs sqlite 3.35, older system libraries read rows back
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
 
 
 # Mapping of Python types with SQL types
@@ -30,9 +96,24 @@ def get_sql_col_type(py_type):
     raise e.GeneralMemoryError(f"Type {py_type} is not supported")
 
 
+def _table_cache(sql_table, kind):
+    """Return the cache dict of kind stored on the table itself.
+
+    Statements and plans reference their table, so keeping them on the
+    table's info dict lets them die with the metadata instead of
+    accumulating in module state as tables are dropped and rebuilt.
+    """
+    return sql_table.info.setdefault(kind, {})
+
+
 def make_stmt(sql_table, return_class, *filtering, **matching):
     """Do select stmt."""
-    stmt = sa.select(*_get_selectables(sql_table, return_class))
+    per_table = _table_cache(sql_table, "membank_selects")
+    stmt = per_table.get(return_class)
+    if stmt is None:
+        stmt = per_table[return_class] = sa.select(
+            *_get_selectables(sql_table, return_class)
+        )
     return filter_stmt(stmt, sql_table, *filtering, **matching)
 
 
@@ -50,7 +131,7 @@ def filter_stmt(stmt, sql_table, *filtering, **matching):
 def get_item(sql_table, engine, return_class, **matching):
     """Get item from table."""
     stmt = make_stmt(sql_table, return_class, **matching)
-    with engine.connect() as conn:
+    with connection(engine) as conn:
         cursor = execute_stmt(conn, stmt).first()
     return return_class(*cursor) if cursor else None
 
@@ -65,64 +146,178 @@ def delete_item(sql_table, engine, **matching):
     """Execute delete stmt."""
     stmt = sa.delete(sql_table)
     stmt = filter_stmt(stmt, sql_table, **matching)
-    with engine.connect() as conn:
+    with writer(engine) as conn:
         execute_stmt(conn, stmt)
-        conn.commit()
+
+
+# Column types whose values need no result processing on read
+_TRIVIAL_COL_TYPES = (sa.String, sa.Float, sa.Integer)
+
+
+def _fetch_raw(cursor, sql):
+    """Fetch all rows from a DBAPI cursor with errors translated."""
+    try:
+        return cursor.execute(sql).fetchall()
+    except sqlite3.Error as error:
+        raise _memory_error(error) from None
+    finally:
+        cursor.close()
+
+
+def _scan_raw(sql_table, engine, return_class, selectables):
+    """Fetch all rows with a DBAPI cursor, skipping result processing."""
+    per_table = _table_cache(sql_table, "membank_scan_sql")
+    sql = per_table.get(return_class)
+    if sql is None:
+        sql = per_table[return_class] = str(sa.select(*selectables).compile(engine))
+    conn = _active_conn_of(engine)
+    if conn is not None:
+        return _fetch_raw(conn.connection.cursor(), sql)
+    raw = engine.raw_connection()
+    try:
+        return _fetch_raw(raw.cursor(), sql)
+    finally:
+        raw.close()
+
+
+def scan_table(sql_table, engine, return_class):
+    """Get all rows of table as lists of values keyed by field name.
+
+    Transposes rows once with zip instead of building a dataclass per
+    row, which suits whole table analysis.  Tables with only str, float
+    and int columns are read with a plain DBAPI cursor so values skip
+    the per-cell result processors.
+    """
+    selectables = tuple(_get_selectables(sql_table, return_class))
+    if all(isinstance(col.type, _TRIVIAL_COL_TYPES) for col in selectables):
+        rows = _scan_raw(sql_table, engine, return_class, selectables)
+    else:
+        stmt = sa.select(*selectables)
+        with connection(engine) as conn:
+            rows = execute_stmt(conn, stmt).fetchall()
+    columns = zip(*rows) if rows else ((),) * len(selectables)
+    return {col.name: list(vals) for col, vals in zip(selectables, columns)}
 
 
 def get_from_sql(return_class, stmt, engine):
     """Get all items from table as per SQL statement."""
-    with engine.connect() as conn:
-        cursor = execute_stmt(conn, stmt)
-        return [return_class(*i) for i in cursor]
+    with connection(engine) as conn:
+        rows = execute_stmt(conn, stmt).fetchall()
+    return [return_class(*row) for row in rows]
+
+
+def _get_upsert(sql_table, cls, key):
+    """Return cached upsert statement with bound parameters per column."""
+    per_table = _table_cache(sql_table, "membank_upserts")
+    stmt = per_table.get((cls, key))
+    if stmt is None:
+        names = [col.name for col, _, _ in _get_plan(cls, sql_table)]
+        stmt = sqlite.insert(sql_table).values(
+            {name: sa.bindparam(name) for name in names}
+        )
+        update_cols = {name: stmt.excluded[name] for name in names if name != key}
+        if update_cols:
+            stmt = stmt.on_conflict_do_update(index_elements=[key], set_=update_cols)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+        if _HAS_RETURNING:
+            stmt = stmt.returning(*_get_selectables(sql_table, cls))
+        per_table[(cls, key)] = stmt
+    return stmt
+
+
+def _run_upsert(engine, stmt, values):
+    """Execute upsert, return the row when RETURNING is available."""
+    with writer(engine) as conn:
+        result = execute_stmt(conn, stmt, values)
+        return result.first() if _HAS_RETURNING else None
+
+
+def _ensure_key_index(sql_table, engine, key):
+    """Create the unique key index that files from older releases lack."""
+    index = sa.Index(f"ix_{sql_table.name}_{key}", sql_table.c[key], unique=True)
+    with writer(engine) as conn:
+        index.create(bind=conn, checkfirst=True)
 
 
 def update_item(sql_table, engine, item, key=None):
-    """Create or update an item in table."""
-    stmt = sa.select(sql_table)
+    """Create or update an item in table.
+
+    Return the persisted row in dataclass field order, or None when a
+    conflicting row was left untouched.
+    """
+    values = {col.name: val for col, val in _unpack_values(item, sql_table)}
     if key:
-        col = _getmemattr(sql_table.c, key)
-        val = getattr(item, key)
-        stmt = stmt.where(col == val)
-    else:
-        for col, val in _unpack_values(item, sql_table):
-            stmt = stmt.where(col == val)
-    with engine.connect() as conn:
-        rows = execute_stmt(conn, stmt)
-        record = rows.first()
-    if not record or (record and key):
-        if record and key:
-            col = getattr(sql_table.c, key)
-            val = getattr(item, key)
-            stmt = sql_table.update()
-            stmt = stmt.where(col == val)
-        else:
-            stmt = sql_table.insert()
-        stmt = stmt.values(dict(_unpack_values(item, sql_table)))
-        with engine.connect() as conn:
-            with conn.begin():
-                execute_stmt(conn, stmt)
+        stmt = _get_upsert(sql_table, type(item), key)
+        try:
+            row = _run_upsert(engine, stmt, values)
+        except e.GeneralMemoryError as error:
+            if "ON CONFLICT clause does not match" not in str(error):
+                raise
+            _ensure_key_index(sql_table, engine, key)
+            row = _run_upsert(engine, stmt, values)
+        if _HAS_RETURNING:
+            return row
+        select_stmt = sa.select(*_get_selectables(sql_table, type(item))).where(
+            sql_table.c[key] == values[key]
+        )
+        with connection(engine) as conn:
+            return execute_stmt(conn, select_stmt).first()
+    selectables = tuple(_get_selectables(sql_table, type(item)))
+    select_stmt = sa.select(*selectables)
+    for name, val in values.items():
+        select_stmt = select_stmt.where(getattr(sql_table.c, name) == val)
+    with connection(engine) as conn:
+        record = execute_stmt(conn, select_stmt).first()
+    if record:
+        return record
+    stmt = sql_table.insert().values(values)
+    if _HAS_RETURNING:
+        stmt = stmt.returning(*selectables)
+        with writer(engine) as conn:
+            return execute_stmt(conn, stmt).first()
+    with writer(engine) as conn:
+        execute_stmt(conn, stmt)
+    with connection(engine) as conn:
+        return execute_stmt(conn, select_stmt).first()
 
 
-def execute_stmt(conn, stmt):
+def insert_items(sql_table, engine, items):
+    """Insert items into table as one batched statement."""
+    rows = [
+        {col.name: val for col, val in _unpack_values(item, sql_table)}
+        for item in items
+    ]
+    with writer(engine) as conn:
+        execute_stmt(conn, sql_table.insert(), rows)
+
+
+def _memory_error(error):
+    """Return the membank error matching a DBAPI error."""
+    msg = str(error)
+    if isinstance(error, TypeError):
+        msg += " Invalid field type, possibly use 'encode' in metadata"
+    if "no such table:" in msg:
+        msg = msg.split(":", maxsplit=1)[-1].strip()
+        return e.MemoryTableDoesNotExist(msg)
+    return e.GeneralMemoryError(msg)
+
+
+def execute_stmt(conn, stmt, parameters=None):
     """Execute SQL statement."""
     try:
-        return conn.execute(stmt)
+        if parameters is None:
+            return conn.execute(stmt)
+        return conn.execute(stmt, parameters)
     except sa.exc.StatementError as error:
-        msg = str(error.orig)
-        if isinstance(error.orig, TypeError):
-            msg += " Invalid field type, possibly use 'encode' in metadata"
-        if "no such table:" in msg:
-            msg = msg.split(":", maxsplit=1)[-1].strip()
-            raise e.MemoryTableDoesNotExist(msg) from None
-        raise e.GeneralMemoryError(msg) from None
+        raise _memory_error(error.orig) from None
 
 
 def sync_table(sql_table, engine, obj):
     """Sync table as per obj values."""
-    with engine.connect() as conn:
+    with connection(engine) as conn:
         alembic = Operations(MigrationContext.configure(conn))
-        fields = dataclasses.fields(obj)
+        fields = get_fields(obj if isinstance(obj, type) else type(obj))
         for field in fields:
             if field.name not in sql_table.c:
                 col_type = get_sql_col_type(field.type)
@@ -137,13 +332,13 @@ def create_table(table, instance, engine):
     Memory attribute must be instance of dataclass In database words
     this adds a new Table
     """
-    with engine.connect() as conn:
+    with connection(engine) as conn:
         alembic = Operations(MigrationContext.configure(conn))
-        fields = dataclasses.fields(instance)
+        fields = get_fields(type(instance))
         cols = []
         for field in fields:
             col_type = get_sql_col_type(field.type)
-            col = sa.Column(field.name, col_type)
+            col = sa.Column(field.name, col_type, unique="key" in field.metadata)
             cols.append(col)
         # pylint: disable=E1101
         try:
@@ -158,15 +353,18 @@ def create_table(table, instance, engine):
 class FilterOperator():
     """Allows to filter memory items by expressions."""
 
-    def __init__(self, name, meta):
+    __slots__ = ("__name", "__meta", "__sql_table", "__column", "__operator")
+
+    def __init__(self, name, meta, column=False):
         """Initialize."""
         self.__name = name
+        self.__meta = meta
         if name in meta.tables:
             self.__sql_table = meta.tables[name]
         else:
             self.__sql_table = None
-        self.__column = False
-        self.__operator = False
+        self.__column = column
+        self.__operator = column is not False
 
     def __lt__(self, other):
         """Operations with <."""
@@ -199,13 +397,15 @@ class FilterOperator():
         return self.__sql_table, op
 
     def __getattr__(self, name):
-        if getattr(self.__sql_table, "name", False):
-            self.__column = getattr(self.__sql_table.c, name, False)
-            if self.__column is False:
-                msg = f"'{self.__name}' does not hold '{name}'"
-                raise e.GeneralMemoryError(msg)
-            self.__operator = True
-        return self
+        if not getattr(self.__sql_table, "name", False):
+            return self
+        column = getattr(self.__sql_table.c, name, False)
+        if column is False:
+            msg = f"'{self.__name}' does not hold '{name}'"
+            raise e.GeneralMemoryError(msg)
+        # The table level operator is shared, so each column access hands
+        # out its own bound instance instead of rebinding in place
+        return FilterOperator(self.__name, self.__meta, column)
 
 
 def _getmemattr(obj, name):
@@ -216,18 +416,30 @@ def _getmemattr(obj, name):
         raise e.MemoryOutOfSyncError(obj, name) from None
 
 
+def _get_plan(cls, table):
+    """Return tuple of (column, field name, encoder) for cls against table."""
+    per_table = _table_cache(table, "membank_plans")
+    plan = per_table.get(cls)
+    if plan is None:
+        plan = tuple(
+            (_getmemattr(table.c, i.name), i.name, i.metadata.get("encode"))
+            for i in get_fields(cls)
+        )
+        per_table[cls] = plan
+    return plan
+
+
 def _unpack_values(obj, table):
     """Unpack values from object using table as reference."""
-    for i in dataclasses.fields(obj):
-        key = _getmemattr(table.c, i.name)
-        val = getattr(obj, i.name)
-        if "encode" in i.metadata:
-            val = i.metadata["encode"](val)
-        yield key, val
+    for col, name, encode in _get_plan(type(obj), table):
+        val = getattr(obj, name)
+        if encode:
+            val = encode(val)
+        yield col, val
 
 
 def _get_selectables(table, obj):
     """Get column names in their respective order as per dataclass object."""
-    for i in dataclasses.fields(obj):
-        key = _getmemattr(table.c, i.name)
-        yield key
+    cls = obj if isinstance(obj, type) else type(obj)
+    for col, _, _ in _get_plan(cls, table):
+        yield col
@@ -1,28 +1,40 @@
 """Defines interface class and functions for library."""
-import dataclasses as data
+import contextlib
 import os
-import urllib.parse
+import stat
+import weakref
 
 import sqlalchemy as sa
 
 from membank import datamapper
 import membank.datamethods as meths
 from membank import errors as e
-from membank.utils import assert_table_name, get_class_name
+from membank.utils import assert_table_name, get_class_name, get_fields
 
 
-def bundle_item(item):
-    """Scan dataclass item for special metadata key value.
+# Key metadata per class, keyed weakly like the caches in utils
+_BUNDLES = weakref.WeakKeyDictionary()
+
+
+def _bundle_for_cls(cls):
+    """Scan dataclass cls for special metadata key value.
 
     Return a dict of found item.
     """
-    meta = {}
-    for i in data.fields(item):
-        if "key" in i.metadata:
-            meta["key"] = i.name
+    meta = _BUNDLES.get(cls)
+    if meta is None:
+        meta = _BUNDLES[cls] = {}
+        for i in get_fields(cls):
+            if "key" in i.metadata:
+                meta["key"] = i.name
     return meta
 
 
+def bundle_item(item):
+    """Return special metadata dict for the class of dataclass item."""
+    return _bundle_for_cls(type(item))
+
+
 class MemoryBlob:
     """Allows to access memory get method dynamically.
 
@@ -33,104 +45,182 @@ class MemoryBlob:
     """
 
     def __init__(self, parent):
-        """Initialise blob with parent and getters."""
-        self.__parent = parent
-        self.__getters = {}
+        """Initialise blob with prebound parent lookups."""
+        self._get_sql_table = parent._get_sql_table
+        self._get_class = parent._get_class
+        self._engine = parent._get_engine()
+        self._sync = parent.sync
 
     def __make_getter_by_name(self, name):
         """Make getter by name."""
         def getter(**kw):
             """Get item from memory."""
             try:
-                table = self.__parent._get_sql_table(name)
+                table = self._get_sql_table(name)
             except e.MemoryTableDoesNotExist:
                 return None
-            classload = self.__parent._get_class(name)
+            classload = self._get_class(name)
             if not classload:
                 return None
-            args = [
-                table,
-                self.__parent._get_engine(),
-                classload
-            ]
             try:
-                return meths.get_item(*args, **kw)
+                return meths.get_item(table, self._engine, classload, **kw)
             except e.MemoryOutOfSyncError:
-                self.__parent.sync(args[2])
-                args[0] = self.__parent._get_sql_table(name)
-                return meths.get_item(*args, **kw)
+                self._sync(classload)
+                table = self._get_sql_table(name)
+                return meths.get_item(table, self._engine, classload, **kw)
         return getter
 
     def __getattr__(self, name):
-        """Get memory attribute."""
-        if name not in self.__getters:
-            self.__getters[name] = self.__make_getter_by_name(name)
-        return self.__getters[name]
+        """Install getter on first access so later lookups are direct."""
+        getter = self.__make_getter_by_name(name)
+        setattr(self, name, getter)
+        return getter
+
+    def __fetch_list(self, sql_table, table_name, filtering, kargs):
+        """Get list of items from table with out of sync retry."""
+        return_class = self._get_class(table_name)
+        try:
+            return meths.get_list(
+                sql_table, self._engine, return_class, *filtering, **kargs
+            )
+        except e.MemoryOutOfSyncError:
+            self._sync(return_class)
+            sql_table = self._get_sql_table(table_name)
+            return meths.get_list(
+                sql_table, self._engine, return_class, *filtering, **kargs
+            )
 
     def __call__(self, *instructions, **kargs):
         """Fetch result from memory.
 
         Expects a table name or a table and a comparison as first argument.
         """
-        filtering = []
-        previous_name = ""
         if len(instructions) == 0:
             msg = "There must be at least one valid comparison to get items"
             raise e.GeneralMemoryError(msg)
+        if len(instructions) == 1:
+            instruction = instructions[0]
+            if isinstance(instruction, tuple):
+                sql_table, sql_operation = instruction
+                table_name = getattr(sql_table, "name", False)
+                filtering = (sql_operation,)
+            else:
+                table_name = instruction
+                filtering = ()
+                try:
+                    sql_table = self._get_sql_table(instruction)
+                except e.MemoryTableDoesNotExist:
+                    table_name = False
+            if not table_name:
+                return []
+            return self.__fetch_list(sql_table, table_name, filtering, kargs)
+        filtering = []
+        seen = set()
         for instruction in instructions:
-            match instruction:
-                case sql_table, sql_operation:
-                    table_name = getattr(sql_table, "name", False)
-                    if table_name:
-                        filtering.append(sql_operation)
-                    else:
-                        return []
-                case table_name:
-                    try:
-                        sql_table = self.__parent._get_sql_table(table_name)
-                    except e.MemoryTableDoesNotExist:
-                        return []
-            if previous_name and previous_name != table_name:
-                raise e.MemoryFilteringError(table_name, previous_name)
-            previous_name = table_name
-        return_class = self.__parent._get_class(previous_name)
-        try:
-            args = [
-                sql_table,
-                self.__parent._get_engine(),
-                return_class,
-            ]
-            return meths.get_list(*args, *filtering, **kargs)
-        except e.MemoryOutOfSyncError:
-            self.__parent.sync(return_class)
-            args[0] = self.__parent._get_sql_table(previous_name)
-            return meths.get_list(*args, *filtering, **kargs)
+            if isinstance(instruction, tuple):
+                sql_table, sql_operation = instruction
+                table_name = getattr(sql_table, "name", False)
+                if not table_name:
+                    return []
+                filtering.append(sql_operation)
+            else:
+                table_name = instruction
+                try:
+                    sql_table = self._get_sql_table(table_name)
+                except e.MemoryTableDoesNotExist:
+                    return []
+            seen.add(table_name)
+        if len(seen) > 1:
+            raise e.MemoryFilteringError(*sorted(seen)[:2])
+        return self.__fetch_list(sql_table, table_name, filtering, kargs)
 
 
 def assert_path(path, db_type):
     """Check for valid path, raise GeneralError if any issue."""
-    msg = None
     if ":memory:" == path:
         if db_type != "sqlite":
             msg = f"Path '{path}' is only allowed to sqlite database"
-    else:
-        path_dir = os.path.dirname(path)
-        path_dir = path_dir if path_dir else "."
-        if not os.path.isdir(path_dir):
-            msg = f"Directory '{path_dir}' does not exist"
-        elif not os.access(path_dir, os.W_OK):
-            msg = f"Directory '{path_dir}' is missing write permissions"
-    if msg:
+            raise e.GeneralMemoryError(msg)
+        return
+    path_dir = os.path.dirname(path)
+    path_dir = path_dir if path_dir else "."
+    try:
+        path_stat = os.stat(path_dir)
+    except OSError:
+        path_stat = None
+    if not path_stat or not stat.S_ISDIR(path_stat.st_mode):
+        msg = f"Directory '{path_dir}' does not exist"
         raise e.GeneralMemoryError(msg)
+    if hasattr(os, "getuid") and path_stat.st_uid == os.getuid():
+        if path_stat.st_mode & stat.S_IWUSR:
+            return
+    if not os.access(path_dir, os.W_OK):
+        msg = f"Directory '{path_dir}' is missing write permissions"
+        raise e.GeneralMemoryError(msg)
+
+
+# Engines shared between LoadMemory instances with the same file url
+_ENGINES = {}
+
+# Pragmas applied to file backed sqlite connections unless overridden
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+}
+
+
+def _enable_sqlite_pragmas(engine, pragmas):
+    """Apply pragmas on every new connection of engine."""
+    @sa.event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _get_engine_for(url, debug, pragmas):
+    """Return engine for url, reusing one engine per distinct setup."""
+    key = (str(url), debug, tuple(sorted(pragmas.items())))
+    engine = _ENGINES.get(key)
+    if engine is None:
+        engine = _ENGINES[key] = sa.create_engine(
+            url,
+            echo=debug,
+            future=True,
+            poolclass=sa.QueuePool,
+            connect_args={"check_same_thread": False},
+        )
+        _enable_sqlite_pragmas(engine, pragmas)
+    return engine
+
+
+def _open_sqlite(path, debug, pragmas):
+    """Create or reuse engine for a sqlite database at path."""
+    assert_path(path, "sqlite")
+    url = sa.engine.URL.create(drivername="sqlite", database=path)
+    if path == ":memory:":
+        return sa.create_engine(url, echo=debug, future=True)
+    if pragmas is None:
+        pragmas = DEFAULT_PRAGMAS
+    return _get_engine_for(url, debug, pragmas)
+
+
+# Engine factory per supported url scheme
+_SCHEMES = {"sqlite": _open_sqlite}
 
 
 class LoadMemory():
     """Loads memory and provides methods to create, change and access it."""
 
-    def __init__(self, url=False, debug=False):
+    def __init__(self, url=False, debug=False, pragmas=None):
         """Initialise memory with base settings.
 
         debug - more verbose logging
+        pragmas - mapping of sqlite PRAGMA names to values applied to file
+        backed databases, defaults to DEFAULT_PRAGMAS (WAL journal with
+        relaxed fsync)
         url - resource locator according to RFC-1738 with scheme to designate database
         type to be used, e.g. sqlite, postgresql, berkeleydb and scheme specific part
         always follow either Common Internet Scheme Syntax or using File scheme part
@@ -143,36 +233,31 @@ class LoadMemory():
         """
         if not url:
             url = "sqlite://:memory:"
-        try:
-            url = urllib.parse.urlparse(url)
-        except AttributeError:
-            raise e.GeneralMemoryError(f"Url '{url}' is not valid") from AttributeError
-        if url.scheme in ["sqlite"]:
-            path = url.netloc + url.path
-            assert_path(path, url.scheme)
-            url = sa.engine.URL.create(
-                drivername=url.scheme,
-                database=path,
-            )
-            self.__engine = sa.create_engine(
-                url,
-                echo=debug,
-                future=True,
-            )
-        else:
-            raise e.GeneralMemoryError(f"Such database type {url.scheme} is not supported")
+        if not isinstance(url, str):
+            raise e.GeneralMemoryError(f"Url '{url}' is not valid")
+        scheme, sep, rest = url.partition("://")
+        if not sep:
+            raise e.GeneralMemoryError(f"Url '{url}' is not valid")
+        opener = _SCHEMES.get(scheme)
+        if opener is None:
+            raise e.GeneralMemoryError(f"Such database type {scheme} is not supported")
+        netloc, sep, tail = rest.partition("/")
+        path = netloc + "/" + tail if sep else netloc
+        self.__engine = opener(path, debug, pragmas)
+        self.__filter_cache = {}
         self.get = MemoryBlob(self)
-        self.__refresh_state()
-        self.__dataclass = datamapper.Mapper(self.__engine, self.__metadata)
-
-    def __refresh_state(self):
-        """Refresh metadata and dataclass."""
         self.__metadata = sa.MetaData()
         self.__metadata.reflect(bind=self.__engine)
+        self.__dataclass = datamapper.Mapper(self.__engine, self.__metadata)
+        self.__reserved = frozenset(dir(self)) | {"__meta_dataclasses__"}
 
     def __getattr__(self, name):
         """Fetch comparison method."""
-        return meths.FilterOperator(name, self.__metadata)
+        operator = self.__filter_cache.get(name)
+        if operator is None:
+            operator = meths.FilterOperator(name, self.__metadata)
+            self.__filter_cache[name] = operator
+        return operator
 
     def _get_sql_table(self, name):
         """Return SQL table."""
@@ -199,46 +284,134 @@ class LoadMemory():
             msg = f"Memory '{item}' cannot be deleted as table '{table}' does not exist"
             raise e.GeneralMemoryError(msg)
         table = self.__metadata.tables[table]
-        meths.delete_item(table, self.__engine, **data.asdict(item))
+        meta = bundle_item(item)
+        if "key" in meta:
+            matching = {meta["key"]: getattr(item, meta["key"])}
+        else:
+            matching = {i.name: getattr(item, i.name) for i in get_fields(type(item))}
+        meths.delete_item(table, self.__engine, **matching)
 
-    def put(self, item):
-        """Insert item in SQL table."""
+    def __assert_table(self, item):
+        """Create table and register class for item if not yet known.
+
+        Return the table name.
+        """
         table = assert_table_name(item)
         if table not in self.__metadata.tables or table == "__meta_dataclasses__":
-            if table in dir(self) or table == "__meta_dataclasses__":
+            if table in self.__reserved:
                 msg = f"Memory {item} cannot be created, such name is reserved by membank"
                 raise e.GeneralMemoryError(msg)
             meths.create_table(table, item, self.__engine)
+            bind = meths.get_active_bind(self.__engine)
+            sa.Table(table, self.__metadata, autoload_with=bind)
+            self.__filter_cache.pop(table, None)
         if not self._get_class(table):
             self._put_class(table, item.__class__)
-            self.__refresh_state()
+        return table
+
+    def put(self, item):
+        """Insert item in SQL table.
+
+        Return the persisted item as read back from the database.
+        """
+        table = self.__assert_table(item)
         sql_table = self._get_sql_table(table)
         meta = bundle_item(item)
         key = meta["key"] if "key" in meta else None
         try:
-            meths.update_item(sql_table, self._get_engine(), item, key)
+            row = meths.update_item(sql_table, self._get_engine(), item, key)
         except e.MemoryOutOfSyncError:
-            self.sync(self._get_class(table))
+            self.sync(item.__class__)
+            sql_table = self._get_sql_table(table)
+            row = meths.update_item(sql_table, self._get_engine(), item, key)
+        return item.__class__(*row) if row else item
+
+    def put_many(self, items):
+        """Insert items in SQL tables, one transaction per table.
+
+        Items are always inserted as new rows in a single batched
+        statement.  Use put for create or update semantics.
+        """
+        grouped = {}
+        for item in items:
+            table = self.__assert_table(item)
+            grouped.setdefault(table, []).append(item)
+        for table, group in grouped.items():
             sql_table = self._get_sql_table(table)
-            meths.update_item(sql_table, self._get_engine(), item, key)
+            try:
+                meths.insert_items(sql_table, self._get_engine(), group)
+            except e.MemoryOutOfSyncError:
+                self.sync(group[0].__class__)
+                sql_table = self._get_sql_table(table)
+                meths.insert_items(sql_table, self._get_engine(), group)
+
+    def scan(self, obj):
+        """Return all rows of a table as columns of plain lists.
+
+        obj may be the dataclass, an instance of it or the table name.
+        Returns a dict of field name to list of values, without
+        allocating a dataclass per row. Empty dict if table is unknown.
+        """
+        if isinstance(obj, str):
+            name = obj
+        else:
+            name = get_class_name(obj if isinstance(obj, type) else type(obj))
+        try:
+            sql_table = self._get_sql_table(name)
+        except e.MemoryTableDoesNotExist:
+            return {}
+        return_class = self._get_class(name)
+        if not return_class:
+            return {}
+        try:
+            return meths.scan_table(sql_table, self._get_engine(), return_class)
+        except e.MemoryOutOfSyncError:
+            self.sync(return_class)
+            sql_table = self._get_sql_table(name)
+            return meths.scan_table(sql_table, self._get_engine(), return_class)
+
+    @contextlib.contextmanager
+    def atomic(self):
+        """Run puts, gets and deletes in the block over one connection.
+
+        All writes commit together when the block exits and roll back
+        on exception.
+        """
+        with self.__engine.connect() as conn:
+            token = meths.activate_connection(conn)
+            try:
+                with conn.begin():
+                    yield
+            finally:
+                meths.deactivate_connection(token)
 
     def sync(self, obj):
         """Synchronise obj with SQL table."""
-        table = get_class_name(obj)
-        self.__dataclass.put_class(table, obj)
-        table = self.__metadata.tables[table]
+        name = get_class_name(obj)
+        self.__dataclass.put_class(name, obj)
+        table = self.__metadata.tables[name]
         meths.sync_table(table, self._get_engine(), obj)
-        self.__refresh_state()
+        bind = meths.get_active_bind(self.__engine)
+        sa.Table(name, self.__metadata, autoload_with=bind, extend_existing=True)
+        self.__filter_cache.pop(name, None)
 
-    def reset(self):
-        """Remove all data and tables."""
+    def reset(self, fast=False):
+        """Remove all data and tables.
+
+        fast - keep table schemas and class registrations, delete all
+        rows in a single transaction instead of issuing DDL
+        """
+        if fast:
+            self.clean_all_data()
+            return
         self.__metadata.drop_all(bind=self.__engine)
         self.__metadata.clear()
+        self.__filter_cache.clear()
         self.__dataclass = datamapper.Mapper(self.__engine, self.__metadata)
 
     def clean_all_data(self):
         """Remove all data and restores memory with all tables."""
-        tables_to_drop = dict(self.__metadata.tables)
-        tables_to_drop.pop("__meta_dataclasses__")
-        self.__metadata.drop_all(bind=self.__engine, tables=tables_to_drop.values())
-        self.__metadata.create_all(bind=self.__engine)
+        with self.__engine.begin() as conn:
+            for name, table in self.__metadata.tables.items():
+                if name != "__meta_dataclasses__":
+                    conn.execute(table.delete())
@@ -1,9 +1,27 @@
 """Membank package wide utils."""
 import dataclasses as data
+import weakref
 
 from membank import errors as e
 
 
+# Caches keyed weakly by class so short-lived classes are not kept alive
+_FIELDS = weakref.WeakKeyDictionary()
+_CLASS_NAMES = weakref.WeakKeyDictionary()
+
+
+def get_fields(cls):
+    """Return dataclass fields of cls, computed once per class."""
+    fields = _FIELDS.get(cls)
+    if fields is None:
+        fields = _FIELDS[cls] = data.fields(cls)
+    return fields
+
+
+# Classes already known to be dataclasses, so checks run once per class
+_KNOWN_CLASSES = weakref.WeakSet()
+
+
 def assert_table_name(instance):
     """Verify that instance is a dataclass instance.
 
@@ -11,13 +29,16 @@ def assert_table_name(instance):
     Return valid table name from instance.
     Raise e.GeneralMemoryError otherwise.
     """
-    if isinstance(instance, type):
-        msg = f"Item {instance} is a class but must be instance of class"
-        raise e.GeneralMemoryError(msg)
-    if not data.is_dataclass(instance):
-        msg = f"Item {instance} must be instance of dataclass"
-        raise e.GeneralMemoryError(msg)
-    for field in data.fields(instance):
+    cls = type(instance)
+    if cls not in _KNOWN_CLASSES:
+        if isinstance(instance, type):
+            msg = f"Item {instance} is a class but must be instance of class"
+            raise e.GeneralMemoryError(msg)
+        if not data.is_dataclass(instance):
+            msg = f"Item {instance} must be instance of dataclass"
+            raise e.GeneralMemoryError(msg)
+        _KNOWN_CLASSES.add(cls)
+    for field in get_fields(cls):
         field_val = getattr(instance, field.name)
         if not isinstance(field_val, field.type):
             if field.type == float and isinstance(field_val, int):
@@ -37,5 +58,7 @@ def get_table_name(cls):
 
 def get_class_name(cls):
     """Get class name."""
-    name = getattr(cls, "__name__", "")
-    return name.lower()
+    name = _CLASS_NAMES.get(cls)
+    if name is None:
+        name = _CLASS_NAMES[cls] = getattr(cls, "__name__", "").lower()
+    return name
@@ -34,19 +34,27 @@ def add_memory(path=None, reset=False):
         class MemoryTestCase(cls):
             """Add memory to TestCase."""
 
+            @classmethod
+            def setUpClass(cls):
+                """Create one shared in-memory database per test class."""
+                super().setUpClass()
+                if not path:
+                    cls.shared_memory = membank.LoadMemory()
+
             def setUp(self):
                 """Set up memory."""
                 if path:
                     self.memory = membank.LoadMemory(path)
                 else:
-                    self.memory = membank.LoadMemory()
+                    self.memory = self.shared_memory
+                    self.memory.reset()
                 super().setUp()
 
             def tearDown(self):
                 """Tear down memory."""
                 super().tearDown()
                 if reset:
-                    self.memory.reset()
+                    self.memory.reset(fast=True)
 
         return MemoryTestCase
 
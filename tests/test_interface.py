@@ -88,7 +88,7 @@ class Transaction:
         if not self.timestamp:
             self.timestamp = datetime.datetime.now()
         if not self.id:
-            self.id = f"special_id:{self.description}"
+            self.id = "special_id:" + self.description
 
 
 @dataclass
@@ -140,9 +140,12 @@ class GetList(b.TestCase):
     def setUp(self):
         """Add transactions as testdata."""
         super().setUp()
-        for i in range(10):
-            booking = Transaction(50 + i, f"list transaction {i}")
-            self.memory.put(booking)
+        now = datetime.datetime.now()
+        bookings = [
+            Transaction(50 + i, f"list transaction {i}", timestamp=now)
+            for i in range(10)
+        ]
+        self.memory.put_many(bookings)
 
     def test_list(self):
         """Retrieve all items from one table."""
@@ -164,6 +167,35 @@ class GetList(b.TestCase):
         """Operators with missing table should return None."""
         self.memory.get(self.memory.nonexisting.timestamp >= False)
 
+    def test_filter_references_stay_bound(self):
+        """Separate filter references keep their own columns."""
+        amount = self.memory.transaction.amount
+        timestamp = self.memory.transaction.timestamp
+        bookings = self.memory.get(amount > 55)
+        self.assertEqual(len(bookings), 4)
+        self.assertTrue(all(i.amount > 55 for i in bookings))
+        today = datetime.datetime.now()
+        self.assertEqual(len(self.memory.get(timestamp <= today)), 10)
+
+    def test_scan(self):
+        """Retrieve whole table as columns of values."""
+        columns = self.memory.scan(Transaction)
+        self.assertEqual(sorted(columns), ["amount", "description", "id", "timestamp"])
+        self.assertEqual(columns["amount"], [50 + i for i in range(10)])
+        self.assertEqual(columns["description"][0], "list transaction 0")
+        self.assertEqual(self.memory.scan("transaction"), columns)
+
+    def test_scan_trivial_columns(self):
+        """Scan table whose columns are read with a plain cursor."""
+        self.memory.put_many([UpdatedDog(f"breed {i}") for i in range(3)])
+        columns = self.memory.scan(UpdatedDog)
+        self.assertEqual(columns["breed"], [f"breed {i}" for i in range(3)])
+        self.assertEqual(columns["color"], ["black"] * 3)
+
+    def test_scan_missing_table(self):
+        """Scan on missing table should return empty dict."""
+        self.assertEqual(self.memory.scan("nonexisting"), {})
+
 
 @b.add_memory()
 class DynamicFields(b.TestCase):
@@ -172,7 +204,8 @@ class DynamicFields(b.TestCase):
     def test(self):
         """Dynamic field must generate id."""
         booking = Transaction(50, "payment for buffer")
-        self.memory.put(booking)
+        returned = self.memory.put(booking)
+        self.assertEqual(booking, returned)
         new_booking = self.memory.get.transaction()
         self.assertEqual(booking.id, new_booking.id)
         self.assertEqual(booking.timestamp, new_booking.timestamp)
@@ -196,9 +229,7 @@ class CreateRead(b.TestCase):
 
     def assert_equal(self, item1, item2):
         """Assert two dogs are equal."""
-        for i in ["breed", "color", "weight"]:
-            self.assertEqual(getattr(item1, i), getattr(item2, i))
-        self.assertIn(str(item1)[:-1], str(item2))
+        self.assertEqual(dataclasses.astuple(item1), dataclasses.astuple(item2))
 
     def test(self):
         """Read and create memory."""
@@ -218,8 +249,7 @@ class CreateRead(b.TestCase):
         memory.put(old_dog)
         memory.put(old_dog)
         new_dog = memory.get.dog()
-        for i in ["breed", "color", "weight"]:
-            self.assertEqual(getattr(old_dog, i), getattr(new_dog, i))
+        self.assertEqual(dataclasses.astuple(old_dog), dataclasses.astuple(new_dog))
 
     def test_file_path_relative(self):
         """Create sqlite with relative file path."""
@@ -227,6 +257,37 @@ class CreateRead(b.TestCase):
         self.assertTrue(memory)
 
 
+@b.add_memory()
+class TransactionBlock(b.TestCase):
+    """Testcase on transaction context manager."""
+
+    def test_commits_once(self):
+        """Puts inside a transaction block commit together."""
+        with self.memory.atomic():
+            self.memory.put(Dog("Puli"))
+            self.memory.put(Transaction(10, "inside block"))
+            self.assertTrue(self.memory.get("dog"))
+        self.assertTrue(self.memory.get("dog"))
+        self.assertTrue(self.memory.get.transaction(description="inside block"))
+
+    def test_rollback(self):
+        """Exception inside the block rolls writes back."""
+        self.memory.put(Dog("Puli"))
+        with self.assertRaises(RuntimeError):
+            with self.memory.atomic():
+                self.memory.put(Dog("Poodle"))
+                raise RuntimeError("boom")
+        self.assertEqual(len(self.memory.get("dog")), 1)
+
+    def test_other_memory_not_captured(self):
+        """Other memory inside the block keeps its own database."""
+        other = membank.LoadMemory()
+        with self.memory.atomic():
+            other.put(Dog("Poodle"))
+        self.assertEqual(self.memory.get("dog"), [])
+        self.assertEqual(len(other.get("dog")), 1)
+
+
 class UpdateHandling(b.TestCase):
     """Do update existing field."""
 
@@ -1,10 +1,34 @@
 """Resilience tests."""
+from dataclasses import dataclass, field
+import os
+import pickle
+import sqlite3
+
+import membank
 from tests import base as b
 from tests.test_interface import Perforator
 
 import sqlalchemy as sa
 
 
+LEGACY_DATABASE_PATH = "tests/data/legacy_database.db"
+
+
+@dataclass
+class Tenant:
+    """Keyed class stored in the legacy schema file."""
+
+    id: str = field(default=None, metadata={"key": True})
+    name: str = "old"
+
+
+@dataclass
+class Driller:
+    """Class unseen by memory until meta table is gone."""
+
+    name: str
+
+
 @b.add_memory()
 class CleanData(b.TestCase):
     """Testcase that cleans __meta_dataclasses__ table while membank has been loaded."""
@@ -15,9 +39,8 @@ class CleanData(b.TestCase):
         self.memory.put(p)
         self.assertTrue(self.memory.get.perforator(name="test"))
         self.commit_stmt("DELETE FROM __meta_dataclasses__")
-        result = self.memory.get.perforator(name="test")
-        # Here might be even better if result is working as expected
-        self.assertIsNone(result)
+        # Already seen classes keep working from the mapper cache
+        self.assertEqual(p, self.memory.get.perforator(name="test"))
         self.memory.put(Perforator("some other perforator"))
         self.assertTrue(self.memory.get.perforator(name="some other perforator"))
         self.assertEqual(p, self.memory.get.perforator(name="test"))
@@ -27,12 +50,56 @@ class CleanData(b.TestCase):
         p = Perforator("test")
         self.memory.put(p)
         self.commit_stmt("DROP TABLE __meta_dataclasses__")
-        self.assertIsNone(self.memory.get.perforator(name="test"))
+        self.assertEqual(p, self.memory.get.perforator(name="test"))
         self.memory.put(p)
 
+    def test_drop_meta_before_new_class(self):
+        """Drop __meta_dataclasses__ table and register a fresh class."""
+        self.memory.put(Perforator("test"))
+        self.commit_stmt("DROP TABLE __meta_dataclasses__")
+        d = Driller("test")
+        self.memory.put(d)
+        self.assertEqual(d, self.memory.get.driller(name="test"))
+
+    def test_drop_table_scan(self):
+        """Scan of an externally dropped table raises the membank error."""
+        self.memory.put(Perforator("test"))
+        self.commit_stmt("DROP TABLE perforator")
+        with self.assertRaises(membank.MemoryTableDoesNotExist):
+            self.memory.scan(Perforator)
+
     def commit_stmt(self, stmt):
         """Destroy meta_dataclasses table."""
         engine = self.memory._get_engine()
         with engine.connect() as conn:
             conn.execute(sa.text(stmt))
             conn.commit()
+
+
+class LegacySchema(b.TestCase):
+    """Testcase on files written before unique key constraints existed."""
+
+    def setUp(self):
+        """Create database with the pre-constraint schema."""
+        if os.path.exists(LEGACY_DATABASE_PATH):
+            os.remove(LEGACY_DATABASE_PATH)
+        conn = sqlite3.connect(LEGACY_DATABASE_PATH)
+        conn.execute(
+            'CREATE TABLE "__meta_dataclasses__" ("table" VARCHAR, classload BLOB)'
+        )
+        conn.execute("CREATE TABLE tenant (id VARCHAR, name VARCHAR)")
+        conn.execute(
+            'INSERT INTO "__meta_dataclasses__" VALUES (?, ?)',
+            ("tenant", pickle.dumps(Tenant)),
+        )
+        conn.commit()
+        conn.close()
+
+    def test_keyed_put(self):
+        """Keyed puts stay writable and idempotent on legacy files."""
+        memory = membank.LoadMemory("sqlite://" + LEGACY_DATABASE_PATH)
+        memory.put(Tenant(id="1"))
+        memory.put(Tenant(id="1", name="Alfred"))
+        tenants = memory.get("tenant")
+        self.assertEqual(len(tenants), 1)
+        self.assertEqual(tenants[0].name, "Alfred")